@@ -3,41 +3,80 @@ Given a Python file that has top-level async code, executes it by first wrapping
 
 The use case is that VS Code has Jupyter cells, which let you run top-level async code. But then running that source file directly from CLI doesn't work because Python doesn't support top-level await.
 This hacks around that by automatically wrapping all of the code in a main function that is then run in an asyncio loop.
+
+Requires Python 3.12+ (for `asyncio.eager_task_factory`). If `uvloop` is installed, it is used as the event loop.
+
+It can also be imported and used via `run(target_script_path)`, which reuses the same event loop across calls.
 """
 
+import ast
+import atexit
 import sys
-import textwrap
 import asyncio
 import traceback
+from collections.abc import Callable, Coroutine
 
-# Template structure
-template = """
-import asyncio
-import sys
+# Shared across calls to `run`, so repeated runs in one process reuse the same loop
+_runner: asyncio.Runner | None = None
 
-# Make sure the embedded code uses the correct event loop context
-# sys.stdout and sys.stderr should be inherited from the parent process
 
-async def main():
-{indented_code}
+def wrap_in_main(tree: ast.Module) -> ast.Module:
+    """Move the module's statements into the body of an `async def main()`."""
+    # Build the function node by parsing it, so we don't depend on the exact
+    # AST constructor signature of the running Python version
+    main = ast.parse("async def main():\n    pass").body[0]
+    main.body = tree.body or [ast.Pass()]
+    tree.body = [main]
+    # Statements keep their original locations, so tracebacks point at the target file
+    return ast.fix_missing_locations(tree)
 
-if __name__ == "__main__":
-    try:
-        # Use the already running loop if available, otherwise create a new one.
+
+def load(target_script_path: str) -> Callable[[], Coroutine]:
+    """Read and compile the target script, returning its wrapped `main` function."""
+    with open(target_script_path, "r", encoding="utf-8") as f:
+        target_code = f.read()
+
+    tree = wrap_in_main(ast.parse(target_code, target_script_path))
+    code = compile(tree, target_script_path, "exec")
+
+    # Define globals for execution, setting __name__ to '__main__'
+    # This also makes modules imported here (like asyncio) available to the target script
+    exec_globals = {
+        "__name__": "__main__",
+        "__file__": target_script_path,  # Mimic script environment
+        "asyncio": asyncio,
+        "sys": sys,
+        "traceback": traceback,
+    }
+    exec(code, exec_globals)
+    return exec_globals["main"]
+
+
+def get_runner() -> asyncio.Runner:
+    """Return the shared runner, creating it on first use."""
+    global _runner
+    if _runner is None:
+        # Use uvloop for a faster event loop if it's installed
         try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError: # No running loop
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+            import uvloop
 
-        # Execute the main coroutine from the embedded script
-        loop.run_until_complete(main())
+            loop_factory = uvloop.new_event_loop
+        except ImportError:
+            loop_factory = None
+
+        _runner = asyncio.Runner(loop_factory=loop_factory)
+        # The eager task factory (Python 3.12+) runs tasks synchronously
+        # until their first real suspension, skipping a trip through the loop.
+        _runner.get_loop().set_task_factory(asyncio.eager_task_factory)
+        atexit.register(_runner.close)
+    return _runner
+
+
+def run(target_script_path: str):
+    """Run the target script on the shared event loop."""
+    main = load(target_script_path)
+    return get_runner().run(main())
 
-    except Exception as e_exec:
-        print(f"Error during execution of embedded script:", file=sys.stderr)
-        traceback.print_exc()
-        sys.exit(1)
-"""
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
@@ -47,39 +86,29 @@ if __name__ == "__main__":
     target_script_path = sys.argv[1]
 
     try:
-        with open(target_script_path, "r", encoding="utf-8") as f:
-            target_code = f.read()
+        main = load(target_script_path)
     except FileNotFoundError:
         print(f"Error: File not found: {target_script_path}", file=sys.stderr)
         sys.exit(1)
-    except Exception as e:
-        print(f"Error reading file {target_script_path}: {e}", file=sys.stderr)
+    except SystemExit:
+        raise
+    except Exception:
+        print(
+            f"Error preparing generated code for {target_script_path}:",
+            file=sys.stderr,
+        )
+        traceback.print_exc()
         sys.exit(1)
 
-    indented_code = textwrap.indent(target_code, "    ")
-
-    final_code = template.format(indented_code=indented_code)
-
-    # Define globals for execution, setting __name__ to '__main__'
-    # This also makes modules imported here (like asyncio) available if needed,
-    # though the template re-imports them for clarity within the exec scope.
-    exec_globals = {
-        "__name__": "__main__",
-        "__file__": target_script_path,  # Mimic script environment
-        # Include builtins and potentially other necessary globals
-        "asyncio": asyncio,
-        "sys": sys,
-        "traceback": traceback,
-    }
-
     try:
-        exec(final_code, exec_globals)
+        # Execute the main coroutine from the embedded script
+        get_runner().run(main())
     except SystemExit:
         # Allow sys.exit() within the executed code to function correctly
         raise
     except Exception:
         print(
-            f"Error preparing or executing generated code for {target_script_path}:",
+            f"Error during execution of embedded script {target_script_path}:",
             file=sys.stderr,
         )
         traceback.print_exc()
@@ -2,14 +2,35 @@
 # ruff: noqa: F704
 # %%
 
+import asyncio
+import difflib
+import functools
+import hashlib
 import os
+import re
+import threading
 import time
 import llm
-from playwright.async_api import async_playwright, Page
+from playwright.async_api import Page
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from sclog import getLogger
 
+import browser_pool
+import model_cache
+
 logger = getLogger(__name__)
 
+# Patterns for stripping content the LLM doesn't need from page HTML
+_SCRIPT_RE = re.compile(r"<(script|style|svg|noscript)\b[^>]*>.*?</\1>", re.I | re.S)
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.S)
+_DATA_URI_RE = re.compile(r"""\s(?:src|srcset)=(["'])data:.*?\1""", re.I | re.S)
+_WS_RE = re.compile(r"\s+")
+# Splits cleaned (single-line) HTML between tags, so it can be diffed line by line
+_TAG_BOUNDARY_RE = re.compile(r"(?<=>) ?(?=<)")
+# Diffing gets slow (and blocks the event loop) on big pages, so just send those in full
+_MAX_DIFF_CHARS = 150_000
+
 # %%
 # Make sure screenshots directory exists
 os.makedirs("screenshots", exist_ok=True)
@@ -17,6 +38,10 @@ os.makedirs("screenshots", exist_ok=True)
 # %%
 START_URL = "https://www.oberlin.edu/"  # 👈 start at Oberlin's main site
 
+# Keep the default short so bad selectors fail fast; navigation gets longer explicitly
+DEFAULT_TIMEOUT_MS = 2500
+NAVIGATION_TIMEOUT_MS = 15000
+
 SYSTEM_PROMPT = """You are an AI-enabled program with excellent understanding of HTML/CSS and no personality.
 
 I am providing you with the HTML of the page I'm currently on.
@@ -32,10 +57,29 @@ At the end, output only the names of the emeriti faculty, one per line.
 
 This is not an interactive session, so do not ask questions or expect responses.
 You can navigate the site by clicking links and returning HTML after each navigation.
+When you already know several steps in a row, prefer the `chain` tool over single calls,
+so that multiple actions run in one turn.
+If a tool returns "<unchanged>", the page HTML is the same as the last HTML you received.
+If it starts with "<diff-from-previous>", it is a unified diff against the last HTML you received.
 """
 
 
 # %%
+def _serialized(method):
+    """
+    Run a tool method while holding the toolbox's lock.
+    llm runs a turn's tool calls concurrently, but results are diffed against
+    the previous HTML sent, so they need to run in the order they were called.
+    """
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        async with self._lock:
+            return await method(self, *args, **kwargs)
+
+    return wrapper
+
+
 # Define tools for the LLM to use
 class PlaywrightTools(llm.Toolbox):
     def __init__(self, page: Page):
@@ -43,55 +87,227 @@ class PlaywrightTools(llm.Toolbox):
         self.page = page
         self.history: list[tuple[str, str]] = []
         self.screenshot_index = 0
+        self._last_hash: bytes | None = None
+        self._prefetched: str | None = None
+        self._last_html: str | None = None
+        self._lock = asyncio.Lock()
 
     async def _get_html(self) -> str:
-        """Return the HTML of the current page."""
-        return await self.page.locator("body").inner_html()
+        """Return the HTML of the current page, stripped of scripts, styles, and comments."""
+        # A single evaluate is one round trip, unlike locator + inner_html
+        try:
+            html = await self.page.evaluate('() => document.body?.outerHTML ?? ""')
+        except PlaywrightError as e:
+            if "Execution context was destroyed" not in str(e):
+                raise
+            # A navigation was in flight; the locator waits for the new page.
+            # Still read outerHTML, so the result matches and can be deduplicated.
+            html = await self.page.locator("body").evaluate("b => b.outerHTML")
+        html = _SCRIPT_RE.sub("", html)
+        html = _COMMENT_RE.sub("", html)
+        html = _DATA_URI_RE.sub("", html)
+        return _WS_RE.sub(" ", html).strip()
+
+    def _changes_only(self, html: str) -> str:
+        """
+        Given page HTML about to be sent to the LLM, return a short marker if it's
+        unchanged since the last one sent, or a diff if only a small part changed.
+        """
+        last, self._last_html = self._last_html, html
+        if last is None:
+            return html
+        if html == last:
+            return "<unchanged>"
+        if max(len(html), len(last)) > _MAX_DIFF_CHARS:
+            return html
+        diff = "\n".join(
+            difflib.unified_diff(
+                _TAG_BOUNDARY_RE.split(last),
+                _TAG_BOUNDARY_RE.split(html),
+                lineterm="",
+                n=1,
+            )
+        )
+        # Only worth it if the diff is much smaller than the page itself
+        if len(diff) < len(html) // 10:
+            return "<diff-from-previous>\n" + diff
+        return html
+
+    async def _prefetch_html(self):
+        """Read the current page HTML ahead of time, for the next `get_html` call."""
+        # This is only speculative, so errors shouldn't stop the run;
+        # `get_html` will just read the page itself
+        try:
+            self._prefetched = await self._get_html()
+        except Exception as e:
+            logger.debug(f"Prefetching HTML failed: {e}")
+            self._prefetched = None
+
+    async def _wait_for_idle(self):
+        """Wait briefly for the network to go idle so the DOM is fully loaded."""
+        try:
+            await self.page.wait_for_load_state("networkidle", timeout=1500)
+        except PlaywrightTimeoutError:
+            pass
 
     async def _take_screenshot(self, label: str):
-        """Save a screenshot with timestamp and step index."""
+        """Save a screenshot with timestamp and step index, unless the page is unchanged."""
+        data = await self.page.screenshot(type="jpeg", quality=70, full_page=True)
+        digest = hashlib.sha256(data).digest()
+        if digest == self._last_hash:
+            logger.info(f"📸 Screenshot unchanged, skipping ({label})")
+            return
+        self._last_hash = digest
         self.screenshot_index += 1
         timestamp = time.strftime("%Y%m%d-%H%M%S")
-        filename = f"screenshots/{self.screenshot_index:03d}-{label}-{timestamp}.png"
-        await self.page.screenshot(path=filename, full_page=True)
+        filename = f"screenshots/{self.screenshot_index:03d}-{label}-{timestamp}.jpg"
+        with open(filename, "wb") as f:
+            f.write(data)
         logger.info(f"📸 Screenshot saved: {filename}")
 
+    @_serialized
     async def click(self, selector: str, description: str = "") -> str:
         """
         Given a CSS or XPATH selector, click on that element.
         For clarity, prefix with `css=` or `xpath=`.
         """
         logger.debug(f"Clicking on {description} ({selector})")
-        await self.page.locator(selector).click()
+        self._prefetched = None
+        try:
+            await self.page.locator(selector).click()
+        except PlaywrightTimeoutError:
+            return (
+                f"Timed out after {DEFAULT_TIMEOUT_MS / 1000}s waiting for {selector}. "
+                "It probably doesn't match a clickable element; try a different selector."
+            )
+        await self._wait_for_idle()
         self.history.append(("click", selector))
         await self._take_screenshot("click")
-        return await self._get_html()
+        return self._changes_only(await self._get_html())
 
+    @_serialized
     async def go_back(self) -> str:
         """Go back one page."""
         logger.debug("Going back")
-        await self.page.go_back()
+        self._prefetched = None
+        await self.page.go_back(
+            timeout=NAVIGATION_TIMEOUT_MS, wait_until="domcontentloaded"
+        )
+        await self._wait_for_idle()
+        self._last_hash = None
         self.history.append(("back", ""))
         await self._take_screenshot("back")
-        return await self._get_html()
-
+        return self._changes_only(await self._get_html())
+
+    async def _chain_error(self, i: int, action: str, problem: str) -> str:
+        """Describe a failed `chain` action to the LLM, along with the current page."""
+        return (
+            f"Action {i} ({action!r}) {problem}. "
+            f"The {i} action(s) before it already ran; the rest were skipped. "
+            "Current page:\n" + self._changes_only(await self._get_html())
+        )
+
+    @_serialized
+    async def chain(self, actions: list[str]) -> str:
+        """
+        Run a sequence of browser actions, then return the HTML of the resulting page.
+        Each action is a string: "click:<selector>", "back", or "goto:<url>".
+        """
+        self._prefetched = None
+        for i, action in enumerate(actions):
+            kind, _, arg = action.partition(":")
+            if not (kind == "back" or (kind in ("click", "goto") and arg)):
+                return await self._chain_error(
+                    i,
+                    action,
+                    'is not valid; use "click:<selector>", "back", or "goto:<url>"',
+                )
+            try:
+                if kind == "click":
+                    logger.debug(f"Chain: clicking on {arg}")
+                    await self.page.locator(arg).click()
+                elif kind == "back":
+                    logger.debug("Chain: going back")
+                    await self.page.go_back(
+                        timeout=NAVIGATION_TIMEOUT_MS, wait_until="domcontentloaded"
+                    )
+                    self._last_hash = None
+                else:
+                    logger.debug(f"Chain: going to {arg}")
+                    await self.page.goto(
+                        arg,
+                        timeout=NAVIGATION_TIMEOUT_MS,
+                        wait_until="domcontentloaded",
+                    )
+                    self._last_hash = None
+                    self._last_html = None
+            except PlaywrightTimeoutError:
+                if kind == "click":
+                    problem = (
+                        f"timed out after {DEFAULT_TIMEOUT_MS / 1000}s; the selector "
+                        "probably doesn't match a clickable element, try a different one"
+                    )
+                else:
+                    problem = f"timed out after {NAVIGATION_TIMEOUT_MS / 1000}s"
+                return await self._chain_error(i, action, problem)
+            except PlaywrightError as e:
+                return await self._chain_error(i, action, f"failed: {e}")
+            self.history.append((kind, arg))
+        await self._wait_for_idle()
+        await self._take_screenshot("chain")
+        return self._changes_only(await self._get_html())
+
+    @_serialized
     async def get_html(self) -> str:
         """Get current page HTML and take screenshot."""
         await self._take_screenshot("html")
-        return await self._get_html()
+        html, self._prefetched = self._prefetched, None
+        if html is None:
+            html = await self._get_html()
+        return self._changes_only(html)
 
 
 # %%
-def should_continue(skip_count: int) -> tuple[bool, int]:
-    """Prompt whether to continue executing LLM tool calls."""
+async def ainput(prompt: str) -> str:
+    """
+    Like `input`, but without blocking the event loop.
+    Reads on a daemon thread, so Ctrl+C can still exit while it's waiting.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(method, value):
+        if not future.done():
+            method(value)
+
+    def read():
+        try:
+            outcome = (future.set_result, input(prompt))
+        except Exception as e:
+            outcome = (future.set_exception, e)
+        try:
+            loop.call_soon_threadsafe(resolve, *outcome)
+        except RuntimeError:
+            pass  # The loop has already been closed
+
+    threading.Thread(target=read, daemon=True).start()
+    return await future
+
+
+async def should_continue(skip_count: int) -> tuple[bool, int]:
+    """Prompt whether to continue executing LLM tool calls, without blocking the event loop."""
     if skip_count > 0:
         return True, skip_count - 1
     try:
-        confirm = input("Continue? (Y/n or number to skip) > ").lower().strip()
-        if confirm.startswith("n"):
+        confirm = await ainput("Continue? (Y/n or number to skip) > ")
+        confirm = confirm.lower().strip()
+        c = confirm[:1]
+        if c == "n":
             return False, 0
         elif confirm.isdigit():
             return True, int(confirm)
+        elif c not in ("", "y"):
+            logger.warning(f"Unrecognized answer {confirm!r}, continuing")
     except EOFError:
         return False, 0
     return True, 0
@@ -100,29 +316,31 @@ def should_continue(skip_count: int) -> tuple[bool, int]:
 ###############################################################################
 # Main logic
 # %%
-playwright = async_playwright()
-p = await playwright.__aenter__()
-browser = await p.chromium.launch(channel="chrome", headless=False)
-context = await browser.new_context(viewport={"width": 1440, "height": 1700})
-page = await context.new_page()
-page.set_default_timeout(8000)
+# Tracing is expensive (it snapshots the DOM on every action), so it's opt-in
+trace_path = "trace.zip" if os.environ.get("BROWSE_TRACE") == "1" else None
+page_cm = browser_pool.page(trace_path=trace_path)
+page = await page_cm.__aenter__()
+page.set_default_timeout(DEFAULT_TIMEOUT_MS)
+page.set_default_navigation_timeout(NAVIGATION_TIMEOUT_MS)
 
-await page.goto(START_URL)
+await page.goto(START_URL, timeout=NAVIGATION_TIMEOUT_MS, wait_until="domcontentloaded")
 
 # initial screenshot
-await page.screenshot(path="screenshots/000-start.png", full_page=True)
+await page.screenshot(
+    path="screenshots/000-start.jpg", type="jpeg", quality=70, full_page=True
+)
 
 # %%
 # Set up LLM
 MODEL = "gemini-2.5-flash"  # or "gpt-4.1-turbo" if available
-model = llm.get_async_model(MODEL)
+model = model_cache.get_async_model(MODEL)
 
 tools = PlaywrightTools(page)
 conversation = model.conversation(tools=[tools])
 
 # Initial query
 response = await conversation.prompt(
-    prompt=await tools._get_html(),
+    prompt=tools._changes_only(await tools._get_html()),
     system=SYSTEM_PROMPT,
     tools=[tools],
 )
@@ -139,10 +357,14 @@ while True:
         break
 
     tool_results = await response.execute_tool_calls()
-    await tools._take_screenshot("step")  # Screenshot after each action
+    # Start the browser work now, so it overlaps with confirmation and the next LLM call
+    screenshot = asyncio.create_task(tools._take_screenshot("step"))
+    prefetch = asyncio.create_task(tools._prefetch_html())
 
-    do_continue, skip_confirmation_for = should_continue(skip_confirmation_for)
+    do_continue, skip_confirmation_for = await should_continue(skip_confirmation_for)
     if not do_continue:
+        prefetch.cancel()
+        await screenshot
         break
 
     response = conversation.prompt(
@@ -150,10 +372,12 @@ while True:
         tool_results=tool_results,
         tools=[tools],
     )
+    response_text, _, _ = await asyncio.gather(response.text(), prefetch, screenshot)
+    logger.debug(f"Response: {response_text}")
 
 # Final output
-final_text = await response.text()
-print(f"Final response:\n{final_text}\n")
+# `response_text` is always the text of the latest `response`
+print(f"Final response:\n{response_text}\n")
 
 print("\nSteps taken:")
 for action, value in tools.history:
@@ -161,7 +385,5 @@ for action, value in tools.history:
 
 await tools._take_screenshot("final")
 
-await page.close()
-await context.close()
-await browser.close()
-await playwright.__aexit__()
+# Only the page is closed (and the trace saved); the browser stays open for the next run
+await page_cm.__aexit__(None, None, None)
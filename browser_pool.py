@@ -0,0 +1,152 @@
+"""
+Keeps one Playwright browser and context alive for the whole process, handing out a fresh page per run.
+
+Launching Chromium is the slowest part of starting a run. When the same process runs the browsing
+script several times (Jupyter cells, or `async_run.run` called repeatedly), this skips that cost
+after the first run. Only the page is closed when a run finishes; the browser is closed at exit.
+
+Because the context is shared, cookies and localStorage carry over between runs in the same
+process, so later runs don't start from a clean session (e.g. a dismissed cookie banner stays
+dismissed). Restart the process (or call `close()`) to start fresh.
+"""
+
+import asyncio
+import atexit
+import os
+from contextlib import asynccontextmanager
+from playwright.async_api import (
+    async_playwright,
+    Browser,
+    BrowserContext,
+    Page,
+    Playwright,
+    Route,
+)
+from sclog import getLogger
+
+logger = getLogger(__name__)
+
+# The LLM only sees HTML, so don't bother downloading these.
+# Stylesheets are still loaded since they affect which elements are visible/clickable.
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+
+_loop: asyncio.AbstractEventLoop | None = None
+_pw: Playwright | None = None
+_browser: Browser | None = None
+_ctx: BrowserContext | None = None
+# Tracing is state on the shared context, so track it in case a run never stopped it
+_tracing = False
+
+
+async def _block_resources(route: Route):
+    """Abort requests for resources the LLM doesn't need."""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def _get_context() -> BrowserContext:
+    """Return the shared context, launching the browser on first use."""
+    global _loop, _pw, _browser, _ctx, _tracing
+    loop = asyncio.get_running_loop()
+    # Playwright objects are bound to the loop they were created on
+    if _ctx is not None and _loop is loop:
+        return _ctx
+    if _ctx is not None:
+        stale = (_pw, _browser, _ctx)
+        _pw = _browser = _ctx = None
+        await _close_stale(_loop, *stale)
+
+    _loop = loop
+    _tracing = False
+    _pw = await async_playwright().start()
+    # Run headless by default; set BROWSE_HEADED=1 to watch the browser
+    headless = os.environ.get("BROWSE_HEADED") != "1"
+    args = [
+        "--disable-gpu",
+        "--disable-dev-shm-usage",
+        "--disable-extensions",
+        "--disable-background-networking",
+        "--disable-renderer-backgrounding",
+    ]
+    # The sandbox matters since the LLM decides which pages get loaded,
+    # so only turn it off when asked (e.g. running as root in a container)
+    if os.environ.get("BROWSE_NO_SANDBOX") == "1":
+        args.append("--no-sandbox")
+    _browser = await _pw.chromium.launch(headless=headless, args=args)
+    _ctx = await _browser.new_context(viewport={"width": 1440, "height": 1700})
+    await _ctx.route("**/*", _block_resources)
+    atexit.register(_close_at_exit, loop)
+    return _ctx
+
+
+async def _close(
+    pw: Playwright | None, browser: Browser | None, ctx: BrowserContext | None
+):
+    """Close the given context, browser, and Playwright instance."""
+    if ctx is not None:
+        await ctx.close()
+    if browser is not None:
+        await browser.close()
+    if pw is not None:
+        await pw.stop()
+
+
+async def _close_stale(
+    loop: asyncio.AbstractEventLoop,
+    pw: Playwright,
+    browser: Browser,
+    ctx: BrowserContext,
+):
+    """Close instances created on a previous event loop, which can't be awaited from this one."""
+    if loop.is_closed():
+        # Nothing can be awaited on a closed loop, so these may leak
+        logger.warning(
+            "Event loop changed; the previous browser may not have shut down"
+        )
+    elif loop.is_running():
+        # Running in another thread
+        asyncio.run_coroutine_threadsafe(_close(pw, browser, ctx), loop)
+    else:
+        await asyncio.to_thread(loop.run_until_complete, _close(pw, browser, ctx))
+
+
+async def close():
+    """Close the shared context, browser, and Playwright instance."""
+    global _pw, _browser, _ctx, _tracing
+    instances = (_pw, _browser, _ctx)
+    _pw = _browser = _ctx = None
+    _tracing = False
+    await _close(*instances)
+
+
+def _close_at_exit(loop: asyncio.AbstractEventLoop):
+    # Only possible if the loop is still around and idle (e.g. not inside a Jupyter kernel)
+    if loop is _loop and not loop.is_closed() and not loop.is_running():
+        loop.run_until_complete(close())
+
+
+@asynccontextmanager
+async def page(trace_path: str | None = None):
+    """
+    Yield a new page in the shared context, closing only the page afterwards.
+    If `trace_path` is given, a Playwright trace is recorded and saved there.
+    """
+    global _tracing
+    context = await _get_context()
+    if _tracing:
+        # Left over from a run that never reached cleanup (e.g. a failed Jupyter cell)
+        await context.tracing.stop()
+        _tracing = False
+    if trace_path is not None:
+        await context.tracing.start(screenshots=True, snapshots=True, sources=True)
+        _tracing = True
+    new_page: Page = await context.new_page()
+    try:
+        yield new_page
+    finally:
+        if trace_path is not None and _tracing:
+            _tracing = False
+            await context.tracing.stop(path=trace_path)
+        await new_page.close()
@@ -0,0 +1,16 @@
+"""
+Caches `llm` model lookups for the whole process.
+
+`llm.get_async_model` asks every installed plugin to register its models on each call.
+The browsing script is re-executed on every run (Jupyter cells, or `async_run.run`), so the cache
+lives in its own module, which stays imported between runs.
+"""
+
+import functools
+import llm
+
+
+@functools.lru_cache(maxsize=4)
+def get_async_model(name: str) -> llm.AsyncModel:
+    """Return the async model with the given name or alias."""
+    return llm.get_async_model(name)